@@ -19,49 +19,99 @@
 # limitations under the License.
 """Autopkg processor to upload files from a Munki repo to VMWare Workspace ONE UEM using REST API"""
 
+import atexit
 import base64
+import functools
 import hashlib
 import json
+import mmap
 import os.path
 import plistlib
 import re
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
+from xml.parsers.expat import ExpatError
 
-# import macsesh  # dependency, needs to be installed
 import requests  # dependency, needs to be installed
 from autopkglib import Processor, ProcessorError, get_pref
-from requests_toolbelt import StreamingIterator  # dependency from requests, needs to be installed
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolKey  # dependency from requests
+from urllib3.util import Retry  # dependency from requests
+
+try:
+    import orjson  # optional dependency, faster parsing of large API search responses
+except ImportError:
+    orjson = None
 
 __all__ = ["WorkSpaceOneImporter"]
 
+# files at least this size are memory mapped for hashing, for small files the mmap setup isn't worth it
+HASH_MMAP_MIN_SIZE = 2**24
+# block size used to send files to the API server
+UPLOAD_BLOCKSIZE = 2**16
+# (connect, read) timeouts in seconds for API calls, requests waits forever for a stalled server otherwise
+API_TIMEOUT = (10, 60)
+# the server may take a while to answer after receiving a large installer, before it returns the blob ID
+UPLOAD_TIMEOUT = (10, 600)
+# input variable values read as true
+TRUTHY_STRINGS = frozenset(("true", "1", "t"))
+# first sequence of digits in a string
+FIRST_INTEGER_RE = re.compile(r"\d+")
+# installer_item_hash in an XML pkginfo, to read it without parsing the whole plist
+INSTALLER_ITEM_HASH_RE = re.compile(rb"<key>installer_item_hash</key>\s*<string>([0-9a-fA-F]+)</string>")
+
 
 def getsha256hash(filename):
     """
     Calculates the SHA-256 hash value of a file as a hex string. Nicked from Munki hash library munkihash.py
+    Reads the file in one streaming pass: large files are memory mapped and hashed in one call, smaller ones are
+    hashed with hashlib.file_digest on Python 3.11+ so the read and hash loop runs in C.
+    This has to stay SHA-256: the result is matched against installer_item_hash values written by Munki.
 
     Args:
         filename: The file name to calculate the hash value of.
     Returns:
         The hash of the given file as hex string.
     """
-    hasher = hashlib.sha256()
     if not os.path.isfile(filename):
         return "NOT A FILE"
     try:
-        fileref = open(filename, "rb")
-        while True:
-            chunk = fileref.read(2**16)
-            if not chunk:
-                break
-            hasher.update(chunk)
-        fileref.close()
-        return hasher.hexdigest()
+        with open(filename, "rb", buffering=0) as fileref:
+            if os.fstat(fileref.fileno()).st_size >= HASH_MMAP_MIN_SIZE:
+                # map large installer items into memory and hash them in one call, without copying to a buffer
+                with mmap.mmap(fileref.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                    if hasattr(mmap, "MADV_SEQUENTIAL"):
+                        mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+                    return hashlib.sha256(mapped_file).hexdigest()
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(fileref, "sha256").hexdigest()
+            # read into one preallocated buffer instead of allocating a new bytes object per chunk
+            hasher = hashlib.sha256()
+            buffer = bytearray(2**20)
+            view = memoryview(buffer)
+            while True:
+                size = fileref.readinto(buffer)
+                if not size:
+                    break
+                hasher.update(view[:size])
+            return hasher.hexdigest()
     except OSError:
         return "HASH_ERROR"
 
 
+@functools.lru_cache(maxsize=4)
+def get_basic_auth_header(username, password):
+    """
+    Basic authorization header value for API username and password, cached as these don't change during a run
+    """
+    hashed_auth = base64.b64encode(f"{username}:{password}".encode("UTF-8")).decode("UTF-8")
+    return f"Basic {hashed_auth}"
+
+
 def get_timestamp():
     """
     RFS3389 Timestamp rounded to nearest second
@@ -70,9 +120,16 @@ def get_timestamp():
     return timestamp
 
 
+def is_truthy(value):
+    """True if an input variable is set to one of TRUTHY_STRINGS (any case) or to boolean True, False if unset"""
+    if value is None:
+        return False
+    return str(value).lower() in TRUTHY_STRINGS
+
+
 def extract_first_integer_from_string(s):
     # Search for the first occurrence of a sequence of digits
-    match = re.search(r"\d+", s)
+    match = FIRST_INTEGER_RE.search(s)
     if match:
         # Convert the first match to an integer and return it
         return int(match.group())
@@ -80,21 +137,139 @@ def extract_first_integer_from_string(s):
 
 
 # validate if a URL was supplied (in input variable) - thanks https://stackoverflow.com/a/52455972
+# cached, as the same few URLs from input variables are checked for every recipe
+@functools.lru_cache(maxsize=32)
 def is_url(url):
+    if not url:
+        return False
     try:
         result = urlparse(url)
-        return all([result.scheme, result.netloc])
+        return bool(result.scheme and result.netloc)
     except ValueError:
         return False
 
 
-def stream_file(filepath, url, headers):
-    """expects headers w/ token, auth, and content-type"""
-    streamer = StreamingIterator(os.path.getsize(filepath), open(filepath, "rb"))
-    r = requests.post(url, data=streamer, headers=headers)
+def response_json(r):
+    """parse the JSON body of a requests Response, with orjson if installed. Raises ValueError if not valid JSON"""
+    if orjson is not None:
+        return orjson.loads(r.content)
+    return r.json()
+
+
+def response_error(r):
+    """get the error message from a failed API call, falls back to the raw body when the server didn't send JSON"""
+    try:
+        result = response_json(r)
+        return f"{result['errorCode']} - {result['message']}" if "errorCode" in result else result["message"]
+    except (ValueError, TypeError, KeyError):
+        return r.text
+
+
+@functools.lru_cache(maxsize=64)
+def load_pkginfo(path, mtime_ns):
+    """
+    parse a pkginfo plist, the result is re-used for the same path as long as its modification time is unchanged,
+    callers pass os.stat(path).st_mtime_ns. The returned dict is shared, it should not be modified.
+    Besides XML and binary plists, pkginfo files in JSON are read, with orjson if installed.
+    """
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data.lstrip()[:1] == b"{":
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+    return plistlib.loads(data)
+
+
+def write_file_atomic(path, content):
+    """
+    write content bytes to a uniquely named temp file next to path and swap it in, so neither a concurrent AutoPkg
+    run writing the same file nor an interrupted one leaves a partial file. The file is readable for the current user
+    only, like the temp file it was created as. Raises OSError if it can't be written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as fp:
+        try:
+            fp.write(content)
+        except OSError:
+            fp.close()
+            os.remove(fp.name)
+            raise
+    try:
+        os.replace(fp.name, path)
+    except OSError:
+        os.remove(fp.name)
+        raise
+
+
+def write_json_atomic(path, data):
+    """write data as JSON to path with write_file_atomic"""
+    write_file_atomic(path, json.dumps(data).encode("UTF-8"))
+
+
+def scan_files(root):
+    """
+    yield os.DirEntry objects for the files in root and its subdirectories, files of a dir before its subdirs like
+    os.walk, but without building the lists os.walk makes and with the file type from the directory read
+    """
+    subdirs = []
+    try:
+        entries = os.scandir(root)
+    except OSError:  # like os.walk, a dir that can't be read has no files
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry
+    for subdir in subdirs:
+        yield from scan_files(subdir)
+
+
+def read_installer_item_hash(path, mtime_ns):
+    """
+    installer_item_hash of a pkginfo file, or None if it has none. In XML plists, as Munki writes them, the value is
+    found with a regular expression running in C, instead of building the whole pkginfo with plistlib.
+    Other plist formats, or XML without a match, are parsed with load_pkginfo.
+    """
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if not data.startswith(b"bplist"):
+        match = INSTALLER_ITEM_HASH_RE.search(data)
+        if match:
+            return match.group(1).decode("ascii")
+    pkg_info = load_pkginfo(path, mtime_ns)
+    return pkg_info.get("installer_item_hash") if isinstance(pkg_info, dict) else None
+
+
+def stream_file(filepath, url, headers, session, params=None):
+    """
+    expects headers w/ token, auth, and content-type, and a requests Session to re-use connections
+    the file object is passed to requests as is, so it is sent in large blocks with a fixed Content-Length and never
+    with chunked Transfer-Encoding, which some gateways buffer completely before passing on
+    """
+    with open(filepath, "rb") as fp:
+        # size from the open file, so it can't differ from what is sent if the file is replaced in the meantime
+        stat = os.fstat(fp.fileno())
+        headers = {**headers, "Content-Length": str(stat.st_size)}
+        # requests falls back to chunked encoding for a file object it measures as empty, send an empty body instead
+        r = session.post(url, params=params, data=fp if stat.st_size else b"", headers=headers, timeout=UPLOAD_TIMEOUT)
+        # the server returns no checksum to compare, but if the file was not written to while it was sent, the
+        # upload has the content that was hashed for the pkginfo, without reading the file again
+        after = os.fstat(fp.fileno())
+        if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            raise OSError(f"[{filepath}] was modified while it was uploaded")
+    r.raise_for_status()
     return r.json()
 
 
+class TimeoutSession(requests.Session):
+    """requests Session that applies API_TIMEOUT to every call that doesn't pass its own timeout"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", API_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
 class WorkSpaceOneImporter(Processor):
     """Uploads apps from Munki repo to WorkSpace ONE"""
 
@@ -147,7 +322,15 @@ class WorkSpaceOneImporter(Processor):
         },
         "ws1_oauth_renew_margin": {
             "required": False,
-            "description": "Oauth2 token is to be renewed when the specified percentage of the expiry time is left",
+            "default": "10",
+            "description": "Oauth2 token is to be renewed when the specified percentage of the expiry time is left. "
+            "Default:10",
+        },
+        "ws1_lookup_cache_hours": {
+            "required": False,
+            "default": "24",
+            "description": "Organization Group and Smart Group IDs resolved through the API are re-used by AutoPkg "
+            "runs for this many hours, 0 looks them up again in every run. Default:24",
         },
         "ws1_oauth_token": {
             "required": False,
@@ -240,41 +423,368 @@ class WorkSpaceOneImporter(Processor):
     }
     description = __doc__
 
+    # IDs resolved through the API don't change during an AutoPkg run, keep them for the next recipes. They are also
+    # saved to the lookup cache file with the time they were resolved, for re-use in runs within ws1_lookup_cache_hours.
+    # Only used from the main thread, the lookups are never run concurrently.
+    _og_id_cache = {}
+    _smartgroup_id_cache = {}
+    _lookup_cache_times = {}
+    # time the lookup cache file was loaded, IDs resolved since are from this run
+    _lookup_cache_loaded_at = None
+    # (path, mtime, size, parsed content) of the last autopkg_results.plist read
+    _run_results_cache = None
+    # installer item hashes by absolute path, loaded from the hash cache file on first use and saved when AutoPkg exits
+    _hash_cache = None
+    _hash_cache_dirty = False
+    # (OAuth token, renew timestamp) by (token url, client ID), so later recipes don't read the cache file again
+    _oauth_token_cache = {}
+    # requests Session shared by all recipes in an AutoPkg run, so connections stay open between them
+    _session = None
+
     # GIT FUNCTIONS
     def git_run(self, repo, cmd):
         """shell out a command to git in the Munki repo"""
         cmd = ["git"] + cmd
         self.output("Running " + " ".join(cmd), verbose_level=2)
         try:
-            # result = subprocess.run(" ".join(cmd), shell=True, cwd=MUNKI_REPO, capture_output=hide_cmd_output)
-            result = subprocess.run(" ".join(cmd), shell=True, cwd=repo, capture_output=True)
+            # run git directly with the argument list, no shell to start and no quoting of paths with spaces needed
+            result = subprocess.run(cmd, cwd=repo, capture_output=True, check=True)
             self.output(result, verbose_level=2)
         except subprocess.CalledProcessError as e:
-            # print(e.stderr)
-            self.output(e.stderr)
-            raise e
+            raise ProcessorError(f"git command failed: {e.stderr.decode('UTF-8', errors='replace').strip()}")
+        except OSError as e:
+            raise ProcessorError(f"Could not run git: {e}")
 
     def git_lfs_pull(self, repo, filename):
         """pull specific LFS filename from git origin"""
-        gitcmd = ["lfs", "pull", f'--include="{filename}"']
+        gitcmd = ["lfs", "pull", f"--include={filename}"]
         self.git_run(repo, gitcmd)
 
+    def cache_file_path(self, name):
+        """path of a file in the AutoPkg cache dir"""
+        return os.path.join(get_pref("CACHE_DIR") or os.path.expanduser("~/Library/AutoPkg/Cache"), name)
+
+    def oauth_cache_path(self, oauth_token_url, oauth_client_id):
+        """path of the file in the AutoPkg cache dir used to keep an OAuth2 token between Autopkg runs"""
+        cache_key = hashlib.sha256(f"{oauth_token_url}{oauth_client_id}".encode("UTF-8")).hexdigest()[:16]
+        return self.cache_file_path(f"ws1_oauth_{cache_key}.plist")
+
+    def oauth_cache_read(self, oauth_token_url, oauth_client_id):
+        """read OAuth2 token and its renew timestamp as saved by a previous run, returns (None, None) if not found"""
+        if (oauth_token_url, oauth_client_id) in self._oauth_token_cache:
+            return self._oauth_token_cache[(oauth_token_url, oauth_client_id)]
+        oauth_cache_file = self.oauth_cache_path(oauth_token_url, oauth_client_id)
+        try:
+            with open(oauth_cache_file, "rb") as fp:
+                oauth_cache = plistlib.load(fp)
+            cached = oauth_cache["access_token"], oauth_cache["renew_timestamp"]
+            self._oauth_token_cache[(oauth_token_url, oauth_client_id)] = cached
+            return cached
+        except FileNotFoundError:
+            return None, None
+        except Exception as err:
+            self.output(f"Ignoring unreadable OAuth token cache file [{oauth_cache_file}]: {err}", verbose_level=2)
+            return None, None
+
+    def oauth_cache_write(self, oauth_token_url, oauth_client_id, oauth_token, oauth_token_renew_timestamp_str):
+        """save OAuth2 token and its renew timestamp for re-use in later runs, readable for current user only"""
+        self._oauth_token_cache[(oauth_token_url, oauth_client_id)] = (oauth_token, oauth_token_renew_timestamp_str)
+        oauth_cache_file = self.oauth_cache_path(oauth_token_url, oauth_client_id)
+        try:
+            write_file_atomic(
+                oauth_cache_file,
+                plistlib.dumps({"access_token": oauth_token, "renew_timestamp": oauth_token_renew_timestamp_str}),
+            )
+        except OSError as err:
+            self.output(f"Could not write OAuth token cache file [{oauth_cache_file}]: {err}", verbose_level=2)
+
+    def hash_cache_path(self):
+        """path of the file in the AutoPkg cache dir used to keep installer item hashes between Autopkg runs"""
+        return self.cache_file_path("ws1_hash_cache.json")
+
+    def cached_sha256(self, filename):
+        """
+        SHA-256 hash of a file, re-used from the hash cache if the file size and modification time did not change
+        since it was hashed. A file rewritten with the same size within the mtime resolution would not be detected,
+        installer items are replaced by downloads or Git LFS pulls, which always update the mtime.
+        """
+        if not os.path.isfile(filename):
+            return getsha256hash(filename)
+        if WorkSpaceOneImporter._hash_cache is None:
+            hash_cache_file = self.hash_cache_path()
+            try:
+                with open(hash_cache_file, "r") as fp:
+                    WorkSpaceOneImporter._hash_cache = json.load(fp)
+            except FileNotFoundError:
+                WorkSpaceOneImporter._hash_cache = {}
+            except (OSError, ValueError) as err:
+                self.output(f"Ignoring unreadable hash cache file [{hash_cache_file}]: {err}", verbose_level=2)
+                WorkSpaceOneImporter._hash_cache = {}
+            # save new hashes and the last use of cached ones once, after the last recipe
+            atexit.register(self.hash_cache_save)
+        key = os.path.abspath(filename)
+        stat = os.stat(filename)
+        entry = self._hash_cache.get(key)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            self.output(f"Using cached hash for [{filename}]", verbose_level=3)
+            entry["last_used"] = time.time()
+            WorkSpaceOneImporter._hash_cache_dirty = True
+            return entry["sha256"]
+
+        itemhash = getsha256hash(filename)
+        if itemhash == "HASH_ERROR":
+            return itemhash
+        self._hash_cache[key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": itemhash,
+            "last_used": time.time(),
+        }
+        WorkSpaceOneImporter._hash_cache_dirty = True
+        return itemhash
+
+    def hash_cache_save(self):
+        """write the hash cache file if any hash was added or used in this run"""
+        if not WorkSpaceOneImporter._hash_cache_dirty:
+            return
+        WorkSpaceOneImporter._hash_cache_dirty = False
+        # drop entries not used for 30 days, so items removed from the repo don't pile up
+        now = time.time()
+        for path in [p for p, e in self._hash_cache.items() if now - e["last_used"] > 30 * 24 * 3600]:
+            del self._hash_cache[path]
+        hash_cache_file = self.hash_cache_path()
+        try:
+            write_json_atomic(hash_cache_file, self._hash_cache)
+        except OSError as err:
+            self.output(f"Could not write hash cache file [{hash_cache_file}]: {err}", verbose_level=2)
+
+    def lookup_cache_path(self):
+        """path of the file in the AutoPkg cache dir used to keep OG and Smart Group IDs between Autopkg runs"""
+        return self.cache_file_path("ws1_lookup_cache.json")
+
+    def lookup_cache_load(self):
+        """
+        load OG and Smart Group IDs resolved by previous runs with the time they were resolved, once per AutoPkg run.
+        Whether they are still fresh enough depends on ws1_lookup_cache_hours of the recipe reading them
+        """
+        if WorkSpaceOneImporter._lookup_cache_loaded_at is not None:
+            return
+        WorkSpaceOneImporter._lookup_cache_loaded_at = time.time()
+        lookup_cache_file = self.lookup_cache_path()
+        try:
+            with open(lookup_cache_file, "r") as fp:
+                lookup_cache = json.load(fp)
+            for base_url, org_group_id, ogid, resolved in lookup_cache["og"]:
+                self._og_id_cache.setdefault((base_url, org_group_id), ogid)
+                self._lookup_cache_times.setdefault(("og", base_url, org_group_id), resolved)
+            for base_url, smartgroup, sg_id, sg_uuid, resolved in lookup_cache["smartgroup"]:
+                self._smartgroup_id_cache.setdefault((base_url, smartgroup), (sg_id, sg_uuid))
+                self._lookup_cache_times.setdefault(("smartgroup", base_url, smartgroup), resolved)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.output(f"Ignoring unreadable lookup cache file [{lookup_cache_file}]: {err}", verbose_level=2)
+
+    def lookup_cache_get(self, kind, cache, key):
+        """
+        ID cached for key, if it was resolved in this run or in a previous run within ws1_lookup_cache_hours of the
+        current recipe, otherwise None
+        """
+        try:
+            lookup_cache_hours = float(self.env.get("ws1_lookup_cache_hours", 24))
+        except (TypeError, ValueError):
+            raise ProcessorError("ws1_lookup_cache_hours should be a number of hours")
+        self.lookup_cache_load()
+        if key not in cache:
+            return None
+        resolved = self._lookup_cache_times.get((kind, *key), 0)
+        if resolved < self._lookup_cache_loaded_at and resolved <= time.time() - lookup_cache_hours * 3600:
+            return None
+        return cache[key]
+
+    def lookup_cache_put(self, kind, cache, key, value):
+        """keep an ID resolved through the API for the next recipes, and save it for later runs"""
+        cache[key] = value
+        self._lookup_cache_times[(kind, *key)] = time.time()
+        self.lookup_cache_save()
+
+    def lookup_cache_save(self):
+        """save the OG and Smart Group IDs resolved so far for re-use in later runs"""
+        lookup_cache_file = self.lookup_cache_path()
+        now = time.time()
+        lookup_cache = {
+            "og": [
+                [base_url, org_group_id, ogid, self._lookup_cache_times.setdefault(("og", base_url, org_group_id), now)]
+                for (base_url, org_group_id), ogid in self._og_id_cache.items()
+            ],
+            "smartgroup": [
+                [
+                    base_url,
+                    smartgroup,
+                    sg_id,
+                    sg_uuid,
+                    self._lookup_cache_times.setdefault(("smartgroup", base_url, smartgroup), now),
+                ]
+                for (base_url, smartgroup), (sg_id, sg_uuid) in self._smartgroup_id_cache.items()
+            ],
+        }
+        try:
+            write_json_atomic(lookup_cache_file, lookup_cache)
+        except OSError as err:
+            self.output(f"Could not write lookup cache file [{lookup_cache_file}]: {err}", verbose_level=2)
+
+    def lookup_cache_invalidate(self):
+        """forget all resolved OG and Smart Group IDs, when an API call using them failed they might be stale"""
+        self.lookup_cache_load()
+        self._og_id_cache.clear()
+        self._smartgroup_id_cache.clear()
+        self._lookup_cache_times.clear()
+        try:
+            os.remove(self.lookup_cache_path())
+        except OSError:
+            pass
+
+    def app_search_cache_path(self, api_base_url, ogid, app_name):
+        """path of the file in the AutoPkg cache dir used to keep the app search results and their ETag"""
+        cache_key = hashlib.sha256(f"{api_base_url}{ogid}{app_name}".encode("UTF-8")).hexdigest()[:16]
+        return self.cache_file_path(f"ws1_app_search_{cache_key}.json")
+
+    def app_search_cache_read(self, api_base_url, ogid, app_name, app_version):
+        """
+        read app search results saved by a previous run, returns None if not found or saved for another app version,
+        as the results decide what to do for the version being imported
+        """
+        app_search_cache_file = self.app_search_cache_path(api_base_url, ogid, app_name)
+        try:
+            with open(app_search_cache_file, "r") as fp:
+                app_search_cache = json.load(fp)
+            if app_search_cache["app_version"] == str(app_version):
+                # mark the file as used, see app_search_cache_prune
+                try:
+                    os.utime(app_search_cache_file)
+                except OSError:
+                    pass
+                return app_search_cache
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.output(f"Ignoring unreadable app search cache file [{app_search_cache_file}]: {err}", verbose_level=2)
+        return None
+
+    def app_search_cache_write(self, api_base_url, ogid, app_name, app_version, etag, search_results):
+        """save app search results with the ETag the server sent, to make a conditional request next run"""
+        app_search_cache_file = self.app_search_cache_path(api_base_url, ogid, app_name)
+        try:
+            write_json_atomic(
+                app_search_cache_file,
+                {"app_version": str(app_version), "etag": etag, "search_results": search_results},
+            )
+        except OSError as err:
+            self.output(f"Could not write app search cache file [{app_search_cache_file}]: {err}", verbose_level=2)
+        self.app_search_cache_prune()
+
+    def app_search_cache_prune(self):
+        """remove app search cache files not used for 30 days, so apps no longer imported don't pile up"""
+        cache_dir = self.cache_file_path("")
+        now = time.time()
+        try:
+            with os.scandir(cache_dir) as entries:
+                for entry in entries:
+                    if (
+                        entry.name.startswith("ws1_app_search_")
+                        and entry.name.endswith(".json")
+                        and now - entry.stat().st_mtime > 30 * 24 * 3600
+                    ):
+                        os.remove(entry.path)
+        except OSError as err:
+            self.output(f"Could not prune app search cache files in [{cache_dir}]: {err}", verbose_level=2)
+
+    def oauth_token_rejected(self, r, headers):
+        """
+        check if the API server rejected the OAuth2 token, which may have been re-used from a previous run and revoked
+        since. If so, invalidate it so the next call to ws1_auth_prep will get a new token, the call can be retried.
+        """
+        if r.status_code == 401 and headers.get("Authorization", "").startswith("Bearer "):
+            self.output("Existing OAuth token was rejected by the API server, renewing it.", verbose_level=2)
+            self.oauth_token_invalidate()
+            return True
+        return False
+
+    def oauth_token_invalidate(self):
+        """forget the current OAuth2 token, both in environment and cache file, so a new one will be requested"""
+        for key in ("ws1_oauth_token", "ws1_oauth_renew_timestamp"):
+            if key in self.env:
+                del self.env[key]
+        oauth_cache_key = (self.env.get("ws1_oauth_token_url"), self.env.get("ws1_oauth_client_id"))
+        self._oauth_token_cache.pop(oauth_cache_key, None)
+        oauth_cache_file = self.oauth_cache_path(*oauth_cache_key)
+        try:
+            os.remove(oauth_cache_file)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            self.output(f"Could not remove OAuth token cache file [{oauth_cache_file}]: {err}", verbose_level=2)
+
+    def ws1_session(self):
+        """
+        requests Session to re-use connections to the WS1 API server for all calls in an import, instead of a new
+        TLS handshake for every call. Retries on transient gateway errors, and calls time out instead of hanging the
+        AutoPkg run on a stalled server.
+        If macsesh is installed, certificates trusted in the macOS keychain are used to validate servers. The trust
+        store is loaded once for this session, instead of patching requests for every other user in the process.
+        The session is kept for the next recipes in the same AutoPkg run.
+        """
+        if WorkSpaceOneImporter._session is not None:
+            return WorkSpaceOneImporter._session
+        session = TimeoutSession()
+        # imported here rather than at module load, loading the keychain trust store is only needed for WS1 calls
+        try:
+            import macsesh  # optional dependency, to trust the API server based on certificates in the macOS keychain
+        except ImportError:
+            macsesh = None
+        if macsesh is not None:
+            adapter_class = macsesh.SimpleKeychainAdapter
+            self.output("Using macOS keychain to validate server certificates", verbose_level=3)
+        else:
+            adapter_class = HTTPAdapter
+        # connection pools for the API server, the OAuth token server and a spare for redirects
+        adapter = adapter_class(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+        )
+        if "key_blocksize" in PoolKey._fields:
+            # send uploads in 64 KiB blocks instead of the default 16 KiB, fewer send() calls for large installers.
+            # urllib3 1.x has no blocksize pool setting, it sends with the http.client default
+            adapter.poolmanager.connection_pool_kw["blocksize"] = UPLOAD_BLOCKSIZE
+        session.mount("https://", adapter)
+        # close the pooled keep-alive connections when AutoPkg exits, after the last recipe
+        atexit.register(session.close)
+        WorkSpaceOneImporter._session = session
+        return session
 
     def get_oauth_token(self, oauth_client_id, oauth_client_secret, oauth_token_url):
         """
-        get OAuth2 token from either environment or
+        get OAuth2 token from either environment, cache file from a previous run or
         fetch new token from Access token server with API
         """
         oauth_token = self.env.get("ws1_oauth_token")
+        oauth_token_renew_timestamp_str = self.env.get("ws1_oauth_renew_timestamp")
         if oauth_token is not None:
             self.output(
                 f"Retrieved existing token from environment: {oauth_token}",
                 verbose_level=4,
             )
-        oauth_token_renew_timestamp_str = self.env.get("ws1_oauth_renew_timestamp")
+        else:
+            oauth_token, oauth_token_renew_timestamp_str = self.oauth_cache_read(oauth_token_url, oauth_client_id)
+            if oauth_token is not None:
+                self.output(
+                    f"Retrieved existing token from cache file: {oauth_token}",
+                    verbose_level=4,
+                )
         if oauth_token_renew_timestamp_str is not None:
             self.output(
-                f"Retrieved existing token renew timestamp from environment: {oauth_token_renew_timestamp_str}",
+                f"Retrieved existing token renew timestamp: {oauth_token_renew_timestamp_str}",
                 verbose_level=4,
             )
         if oauth_token_renew_timestamp_str is not None:
@@ -293,6 +803,7 @@ class WorkSpaceOneImporter(Processor):
         if oauth_token is None or oauth_token_renew_timestamp is None or timestamp >= oauth_token_renew_timestamp:
             # need to get e new token
             self.output("Renewing OAuth access token", verbose_level=3)
+            oauth_renew_margin = float(self.env.get("ws1_oauth_renew_margin") or 10)
             request_body = {
                 "grant_type": "client_credentials",
                 "client_id": oauth_client_id,
@@ -301,7 +812,7 @@ class WorkSpaceOneImporter(Processor):
             self.output(f"OAuth token request body: {request_body}", verbose_level=4)
 
             try:
-                r = requests.post(oauth_token_url, data=request_body)
+                r = self.session.post(oauth_token_url, data=request_body)
                 r.raise_for_status()
             except requests.exceptions.HTTPError as err:
                 raise ProcessorError(f"WorkSpaceOneImporter: Oauth token server response code: {err}")
@@ -314,8 +825,21 @@ class WorkSpaceOneImporter(Processor):
             )
             result = r.json()
             self.output(f"OAuth token request result: {result}", verbose_level=4)
-            oauth_token = result["access_token"]
-            renew_threshold = round(result["expires_in"] * (100 - oauth_renew_margin) / 100)
+            try:
+                oauth_token = result["access_token"]
+                expires_in = int(result["expires_in"])
+            except (KeyError, TypeError, ValueError):
+                raise ProcessorError("WorkSpaceOneImporter: Oauth token server response lacks access_token/expires_in")
+            # renew at the margin percentage before expiry, but leave at least 30 seconds for the calls made with it
+            renew_threshold = round(expires_in * (100 - oauth_renew_margin) / 100)
+            if expires_in > 60:
+                renew_threshold = min(renew_threshold, expires_in - 30)
+            if renew_threshold <= 0:
+                self.output(
+                    f"OAuth token expires in {expires_in} seconds, renewing it on next use",
+                    verbose_level=2,
+                )
+                renew_threshold = 0
             self.output(
                 f"OAuth token threshold for renewal set to {renew_threshold} seconds",
                 verbose_level=3,
@@ -327,6 +851,7 @@ class WorkSpaceOneImporter(Processor):
             )
             self.env["ws1_oauth_token"] = oauth_token
             self.env["ws1_oauth_renew_timestamp"] = oauth_token_renew_timestamp.isoformat()
+            self.oauth_cache_write(oauth_token_url, oauth_client_id, oauth_token, self.env["ws1_oauth_renew_timestamp"])
         self.output(
             f"Current timestamp: {timestamp.isoformat()} - "
             f"re-using current OAuth token until: {oauth_token_renew_timestamp.isoformat()}",
@@ -374,8 +899,7 @@ class WorkSpaceOneImporter(Processor):
                     verbose_level=1,
                 )
             else:  # if NOT specified, use USERNAME and PASSWORD
-                hashed_auth = base64.b64encode(f"{ws1_api_username}:{ws1_api_password}".encode("UTF-8"))
-                basicauth = f"Basic {hashed_auth}".decode("utf-8")
+                basicauth = get_basic_auth_header(ws1_api_username, ws1_api_password)
             self.output(f"Authorization header: {basicauth}", verbose_level=3)
             headers = {
                 "aw-tenant-code": ws1_api_token,
@@ -392,10 +916,16 @@ class WorkSpaceOneImporter(Processor):
     def get_smartgroup_id(self, base_url, smartgroup, headers):
         """Get Smart Group ID and UUID to assign the package to"""
 
-        # we need to replace any spaces with '%20' for the API call
-        condensed_sg = smartgroup.replace(" ", "%20")
-        r = requests.get(
-            f"{base_url}/api/mdm/smartgroups/search?name={condensed_sg}",
+        cached = self.lookup_cache_get("smartgroup", self._smartgroup_id_cache, (base_url, smartgroup))
+        if cached is not None:
+            sg_id, sg_uuid = cached
+            self.output(f"Smart Group ID: {sg_id} UUID: {sg_uuid} (resolved earlier)", verbose_level=2)
+            return sg_id, sg_uuid
+
+        # let requests encode the name in the query string, it may contain spaces or other reserved characters
+        r = self.session.get(
+            f"{base_url}/api/mdm/smartgroups/search",
+            params={"name": smartgroup},
             headers=headers,
         )
         if not r.status_code == 200:
@@ -404,33 +934,69 @@ class WorkSpaceOneImporter(Processor):
             )
         sg_uuid = sg_id = ""
         try:
-            smart_group_results = r.json()
-            for sg in smart_group_results["SmartGroups"]:
-                if smartgroup in sg["Name"]:
-                    sg_id = sg["SmartGroupID"]
-                    self.output(f"Smart Group ID: {sg_id}", verbose_level=2)
-                    sg_uuid = sg["SmartGroupUuid"]
-                    self.output(f"Smart Group UUID: {sg_uuid}", verbose_level=2)
-                    break
-        except (ValueError, TypeError):
+            smart_group_results = response_json(r)
+            # the search matches on part of the name, prefer the group with exactly the name asked for
+            smart_groups_by_name = {sg["Name"]: sg for sg in smart_group_results["SmartGroups"]}
+            sg = smart_groups_by_name.get(smartgroup)
+            if sg is None:
+                sg = next((sg for name, sg in smart_groups_by_name.items() if smartgroup in name), None)
+                if sg is not None:
+                    self.output(
+                        f"No Smart Group named exactly [{smartgroup}], using [{sg['Name']}] instead",
+                    )
+            if sg is not None:
+                sg_id = sg["SmartGroupID"]
+                self.output(f"Smart Group ID: {sg_id}", verbose_level=2)
+                sg_uuid = sg["SmartGroupUuid"]
+                self.output(f"Smart Group UUID: {sg_uuid}", verbose_level=2)
+        except (ValueError, TypeError, KeyError):
             raise ProcessorError("failed to parse results from Smart Group search API call")
+        if sg_id:
+            self.lookup_cache_put("smartgroup", self._smartgroup_id_cache, (base_url, smartgroup), (sg_id, sg_uuid))
         return sg_id, sg_uuid
 
-    def ws1_import(self, pkg_path, pkg_info_path, icon_path):
+    def check_smartgroup_exists(self, base_url, smartgroup, headers):
+        """Raise if the Smart Group for simple assignment can't be found, the lookup is cached for the assignment"""
+        if not smartgroup or smartgroup == "none":
+            return
+        sg_id, _ = self.get_smartgroup_id(base_url, smartgroup, headers)
+        if not sg_id:
+            raise ProcessorError(
+                f"WorkSpaceOneImporter: Smart Group [{smartgroup}] not found on server, nothing was uploaded - "
+                "bailing out."
+            )
+
+    def get_icon_path(self, pkg_info):
+        """
+        Get icon file settings. Use pkginfo icon_name key if present, if not check for common icon file.
+        Returns None if no icon file can be found, to proceed to WS1 with what we have regardless.
+        """
+        if "icon_name" not in pkg_info:
+            # if key isn't present, look for common icon file with same 'first' name as installer item
+            icon_path = os.path.join(self.env["MUNKI_REPO"], "icons", f"{self.env['NAME']}.png")
+            self.output(f"Looking for icon file [{icon_path}]", verbose_level=1)
+        else:
+            # when icon was specified for this installer version
+            icon_path = os.path.join(self.env["MUNKI_REPO"], "icons", pkg_info["icon_name"])
+            self.output(f"Icon file for this installer version was specified as [{icon_path}]")
+        # if we can't read or find any icon, proceed with upload regardless. A directory at the path is skipped as
+        # well, it could not be uploaded
+        if os.path.isfile(icon_path):
+            return icon_path
+        self.output(f"Could not read icon file [{icon_path}] - skipping.")
+        return None
+
+    def ws1_import(self, pkg_path, pkg_info_path):
         """high-level method for Workspace ONE API interactions like uploading an app, app assignment(s) and pruning
         old app versions"""
-        self.output("Beginning the WorkSpace ONE import process for %s." % self.env["NAME"])
+        self.output(f"Beginning the WorkSpace ONE import process for {self.env['NAME']}.")
         api_base_url = self.env.get("ws1_api_url")
         console_url = self.env.get("ws1_console_url")
         org_group_id = self.env.get("ws1_groupid")
         assignment_group = self.env.get("ws1_smart_group_name")
         assignment_pushmode = self.env.get("ws1_push_mode")
-        force_import = self.env.get("ws1_force_import").lower() in ("true", "1", "t")
-        update_assignments = self.env.get("ws1_update_assignments").lower() in (
-            "true",
-            "1",
-            "t",
-        )
+        force_import = is_truthy(self.env.get("ws1_force_import"))
+        update_assignments = is_truthy(self.env.get("ws1_update_assignments"))
 
         # init result
         self.env["ws1_imported_new"] = False
@@ -449,8 +1015,7 @@ class WorkSpaceOneImporter(Processor):
         # Get some global variables for later use from pkginfo, don't rely on
         # munki_importer_summary_result being filled in current session
         try:
-            with open(pkg_info_path, "rb") as fp:
-                pkg_info = plistlib.load(fp)
+            pkg_info = load_pkginfo(pkg_info_path, os.stat(pkg_info_path).st_mtime_ns)
         except IOError:
             raise ProcessorError(f"Could not read pkg_info file [{pkg_info_path}]")
         except Exception:
@@ -461,204 +1026,213 @@ class WorkSpaceOneImporter(Processor):
         if "name" not in pkg_info:
             raise ProcessorError(f"name not found in pkginfo [{pkg_info_path}]")
         app_name = pkg_info["name"]
+        icon_path = self.get_icon_path(pkg_info)
+
+        # re-use connections to the API server for all calls
+        self.session = self.ws1_session()
 
         # take care of headers for WS1 REST API authentication
         headers, headers_v2 = self.ws1_auth_prep()
 
-        # get OG ID from GROUPID
-        result = ""
-        try:
-            r = requests.get(
-                f"{api_base_url}/api/system/groups/search?groupid={org_group_id}",
-                headers=headers_v2,
-            )
-            result = r.json()
-            r.raise_for_status()
-        except AttributeError:
-            raise ProcessorError(
-                "WorkSpaceOneImporter:"
-                f"Unable to retrieve an ID for the Organizational GroupID specified: {org_group_id}"
-            )
-        except requests.exceptions.HTTPError as err:
-            raise ProcessorError(
-                f"WorkSpaceOneImporter: Server responded with error when making the OG ID API call: {err}"
-            )
-        except requests.exceptions.RequestException as e:
-            ProcessorError(f"WorkSpaceOneImporter: Error making the OG ID API call: {e}")
-        ogid = ""
-        if org_group_id in result["OrganizationGroups"][0]["GroupId"]:
-            ogid = result["OrganizationGroups"][0]["Id"]
+        # get OG ID from GROUPID, unless already resolved for a previous recipe or a recent AutoPkg run
+        ogid = self.lookup_cache_get("og", self._og_id_cache, (api_base_url, org_group_id))
+        if ogid is None:
+            og_search_url = f"{api_base_url}/api/system/groups/search"
+            try:
+                r = self.session.get(og_search_url, params={"groupid": org_group_id}, headers=headers_v2)
+                if self.oauth_token_rejected(r, headers):
+                    headers, headers_v2 = self.ws1_auth_prep()
+                    r = self.session.get(og_search_url, params={"groupid": org_group_id}, headers=headers_v2)
+                r.raise_for_status()
+                organization_group = response_json(r)["OrganizationGroups"][0]
+            except requests.exceptions.HTTPError as err:
+                raise ProcessorError(
+                    f"WorkSpaceOneImporter: Server responded with error when making the OG ID API call: {err}"
+                )
+            except requests.exceptions.RequestException as e:
+                raise ProcessorError(f"WorkSpaceOneImporter: Error making the OG ID API call: {e}")
+            except (ValueError, KeyError, IndexError, TypeError):
+                raise ProcessorError(
+                    "WorkSpaceOneImporter:"
+                    f"Unable to retrieve an ID for the Organizational GroupID specified: {org_group_id}"
+                )
+            ogid = ""
+            if org_group_id in organization_group["GroupId"]:
+                ogid = organization_group["Id"]
+                self.lookup_cache_put("og", self._og_id_cache, (api_base_url, org_group_id), ogid)
         self.output(f"Organisation group ID: {ogid}", verbose_level=2)
 
-        # Check for app versions already present on WS1 server
+        # Check for app versions already present on WS1 server, let the server filter on macOS apps
+        app_search_url = f"{api_base_url}/api/mam/apps/search"
+        app_search_params = {"locationgroupid": ogid, "applicationname": app_name, "platform": "AppleOsX"}
+        # ask the server to only send the search results if they changed since the previous run
+        search_cache = self.app_search_cache_read(api_base_url, ogid, app_name, app_version)
+        search_etag = {"If-None-Match": search_cache["etag"]} if search_cache else {}
         try:
-            condensed_app_name = app_name.replace(" ", "%20")
-            r = requests.get(
-                f"{api_base_url}/api/mam/apps/search?locationgroupid={ogid}&applicationname=" f"{condensed_app_name}",
-                headers=headers,
+            r = self.session.get(
+                app_search_url,
+                params=app_search_params,
+                headers={**headers, **search_etag},
             )
-        except Exception:
-            raise ProcessorError("Something went wrong handling pre-existing app version on server")
-        if r.status_code == 200:
-            search_results = r.json()
+            if self.oauth_token_rejected(r, headers):
+                headers, headers_v2 = self.ws1_auth_prep()
+                r = self.session.get(
+                    app_search_url,
+                    params=app_search_params,
+                    headers={**headers, **search_etag},
+                )
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as err:
+            # the OG ID used in the search might be stale
+            self.lookup_cache_invalidate()
+            raise ProcessorError(f"Something went wrong handling pre-existing app version on server: {err}")
+        except requests.exceptions.RequestException as err:
+            raise ProcessorError(f"Something went wrong handling pre-existing app version on server: {err}")
+        search_results = None
+        if r.status_code == 304 and search_cache:
+            self.output("App search results unchanged since previous run, using cached results", verbose_level=2)
+            search_results = search_cache["search_results"]
+        elif r.status_code == 200:
+            search_results = response_json(r)
+            if r.headers.get("ETag"):
+                self.app_search_cache_write(
+                    api_base_url, ogid, app_name, app_version, r.headers["ETag"], search_results
+                )
+        if search_results is not None:
 
             # handle older versions of app already present on WS1 UEM
-            self.ws1_app_versions_prune(api_base_url, headers, app_name, search_results)
-
-            # handle any updates that might be needed for the latest app version already present on WS1 UEM
-            for app in search_results["Application"]:
-                if (
-                    app["Platform"] == 10
-                    and app["ActualFileVersion"] == str(app_version)
-                    and app["ApplicationName"] in app_name
-                ):
-                    ws1_app_id = app["Id"]["Value"]
-                    self.env["ws1_app_id"] = ws1_app_id
-                    self.output("Pre-existing App ID: %s" % ws1_app_id, verbose_level=2)
-                    self.output(f"Pre-existing App version: {app_version}", verbose_level=2)
-                    self.output(
-                        f"Pre-existing App platform: {app['Platform']}",
-                        verbose_level=3,
-                    )
-                    # if not self.env.get("ws1_force_import").lower() == "true":
-                    if not force_import:
-                        if update_assignments and not assignment_group == "none":
-                            self.output("updating simple app assignment", verbose_level=2)
-                            app_assignment = self.ws1_app_assignment_conf(
-                                api_base_url,
-                                assignment_pushmode,
-                                assignment_group,
-                                headers,
-                            )
-                            self.ws1_app_assign(
-                                api_base_url,
-                                assignment_group,
-                                app_assignment,
-                                headers,
-                                ws1_app_id,
-                            )
-                            self.env["ws1_importer_summary_result"] = {
-                                "summary_text": "The following new app assignment was made in WS1:",
-                                "report_fields": [
-                                    "name",
-                                    "version",
-                                    "assignment_group",
-                                ],
-                                "data": {
-                                    "name": self.env["NAME"],
-                                    "version": app_version,
-                                    "assignment_group": assignment_group,
-                                },
-                            }
-                        elif update_assignments and not app_assignments == "none":
-                            self.output("updating advanced app assignment", verbose_level=2)
-                            self.ws1_app_assignments(api_base_url, app_assignments, headers, ws1_app_id)
-                        elif update_assignments:
-                            raise ProcessorError(
-                                "update_assignments is True, but ws1_smart_group_name is not"
-                                " specified and neither is ws1_app_assignments"
-                            )
-                        else:
-                            self.output(
-                                f"App [{app_name}] version [{app_version}] is already present on server, "
-                                "and neither ws1_force_import nor ws1_update_assignments is set."
-                            )
-                        return "Nothing new to upload - completed."
+            self.ws1_app_versions_prune(api_base_url, headers, headers_v2, app_name, search_results)
+
+            # handle any updates that might be needed for the latest app version already present on WS1 UEM.
+            # The search matches on part of the name, only take the app with exactly this name
+            app_version_str = str(app_version)
+            app = next(
+                (
+                    app
+                    for app in search_results["Application"]
+                    if app["Platform"] == 10
+                    and app["ActualFileVersion"] == app_version_str
+                    and app["ApplicationName"] == app_name
+                ),
+                None,
+            )
+            if app is not None:
+                ws1_app_id = app["Id"]["Value"]
+                self.env["ws1_app_id"] = ws1_app_id
+                self.output(f"Pre-existing App ID: {ws1_app_id}", verbose_level=2)
+                self.output(f"Pre-existing App version: {app_version}", verbose_level=2)
+                self.output(
+                    f"Pre-existing App platform: {app['Platform']}",
+                    verbose_level=3,
+                )
+                # if not self.env.get("ws1_force_import").lower() == "true":
+                if not force_import:
+                    if update_assignments and not assignment_group == "none":
+                        self.output("updating simple app assignment", verbose_level=2)
+                        app_assignment = self.ws1_app_assignment_conf(
+                            api_base_url,
+                            assignment_pushmode,
+                            assignment_group,
+                            headers,
+                        )
+                        self.ws1_app_assign(
+                            api_base_url,
+                            assignment_group,
+                            app_assignment,
+                            headers,
+                            ws1_app_id,
+                        )
+                        self.env["ws1_importer_summary_result"] = {
+                            "summary_text": "The following new app assignment was made in WS1:",
+                            "report_fields": [
+                                "name",
+                                "version",
+                                "assignment_group",
+                            ],
+                            "data": {
+                                "name": self.env["NAME"],
+                                "version": app_version,
+                                "assignment_group": assignment_group,
+                            },
+                        }
+                    elif update_assignments and not app_assignments == "none":
+                        self.output("updating advanced app assignment", verbose_level=2)
+                        self.ws1_app_assignments(api_base_url, app_assignments, headers, headers_v2, ws1_app_id, app)
+                    elif update_assignments:
+                        raise ProcessorError(
+                            "update_assignments is True, but ws1_smart_group_name is not"
+                            " specified and neither is ws1_app_assignments"
+                        )
                     else:
                         self.output(
-                            f"App [{app_name}] version [{app_version}] already present on server, and "
-                            f"ws1_force_import==True, attempting to delete on server first."
+                            f"App [{app_name}] version [{app_version}] is already present on server, "
+                            "and neither ws1_force_import nor ws1_update_assignments is set."
                         )
-                        try:
-                            r = requests.delete(
-                                f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}",
-                                headers=headers,
-                            )
-                        except requests.exceptions.RequestException as err:
-                            raise ProcessorError(
-                                f"ws1_force_import - delete of pre-existing app failed, error: {err}, aborting."
-                            )
-                        if not r.status_code == 202 and not r.status_code == 204:
-                            result = r.json()
-                            self.output(f"App delete result: {result}", verbose_level=3)
-                            raise ProcessorError("ws1_force_import - delete of pre-existing app failed, aborting.")
-                        try:
-                            r = requests.get(
-                                f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}",
-                                headers=headers,
-                            )
-                            if not r.status_code == 401:
-                                result = r.json()
-                                self.output(
-                                    f"App not deleted yet, status: {result['Status']} - retrying",
-                                    verbose_level=2,
-                                )
-                                requests.delete(
-                                    f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}",
-                                    headers=headers,
-                                )
-                        except requests.exceptions.RequestException as err:
-                            raise ProcessorError(
-                                f"ws1_force_import - delete of pre-existing app failed, error: {err} aborting."
-                            )
-                        self.output(f"Pre-existing App [ID: {ws1_app_id}] now successfully deleted")
-                        break
+                    return "Nothing new to upload - completed."
+                else:
+                    # don't delete the app on the server when the new version can't be assigned afterwards
+                    self.check_smartgroup_exists(api_base_url, assignment_group, headers)
+                    self.output(
+                        f"App [{app_name}] version [{app_version}] already present on server, and "
+                        f"ws1_force_import==True, attempting to delete on server first."
+                    )
+                    try:
+                        r = self.session.delete(
+                            f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}",
+                            headers=headers,
+                        )
+                    except requests.exceptions.RequestException as err:
+                        raise ProcessorError(
+                            f"ws1_force_import - delete of pre-existing app failed, error: {err}, aborting."
+                        )
+                    if not r.status_code == 202 and not r.status_code == 204:
+                        self.output(f"App delete result: {response_error(r)}", verbose_level=3)
+                        raise ProcessorError("ws1_force_import - delete of pre-existing app failed, aborting.")
+                    if r.status_code == 202:
+                        # delete was accepted but may not be completed yet
+                        self.ws1_app_wait_deleted(api_base_url, ws1_app_id, headers, r)
+                    self.output(f"Pre-existing App [ID: {ws1_app_id}] now successfully deleted")
         elif r.status_code == 204:
             # app not found on WS1 server, so we're fine to proceed with upload
             self.output(f"App [{app_name}] version [{app_version}] is not yet present on server, will attempt upload")
 
         # proceed with upload
-        if pkg_path is not None:
-            self.output("Uploading pkg...")
-            # upload pkg, dmg, mpkg file (application/json)
-            headers["Content-Type"] = "application/json"
-            posturl = (
-                f"{api_base_url}/api/mam/blobs/uploadblob?filename={os.path.basename(pkg_path)}"
-                f"&organizationGroupId={str(ogid)}"
-            )
-            try:
-                res = stream_file(pkg_path, posturl, headers)
-                pkg_id = res["Value"]
-                self.output(f"Pkg ID: {pkg_id}")
-            except KeyError:
-                raise ProcessorError("WorkSpaceOneImporter: Something went wrong while uploading the pkg.")
-        else:
+        if pkg_path is None:
             raise ProcessorError("WorkSpaceOneImporter: Did not receive a pkg_path from munkiimporter.")
-
-        if pkg_info_path is not None:
-            self.output("Uploading pkg_info...")
-            # upload pkginfo plist (application/json)
-            headers["Content-Type"] = "application/json"
-            posturl = (
-                f"{api_base_url}/api/mam/blobs/uploadblob?filename={os.path.basename(pkg_info_path)}"
-                f"&organizationGroupId={str(ogid)}"
-            )
-            try:
-                res = stream_file(pkg_info_path, posturl, headers)
-                pkginfo_id = res["Value"]
-                self.output(f"PkgInfo ID: {pkginfo_id}")
-            except KeyError:
-                raise ProcessorError("WorkSpaceOneImporter: Something went wrong while uploading the pkginfo.")
-        else:
+        if pkg_info_path is None:
             raise ProcessorError("WorkSpaceOneImporter: Did not receive a pkg_info_path from munkiimporter.")
+        # fail before uploading anything when the Smart Group to assign to doesn't exist
+        self.check_smartgroup_exists(api_base_url, assignment_group, headers)
+
+        # upload pkg, dmg, mpkg file, pkginfo plist and icon file (application/json) concurrently, so the small
+        # pkginfo and icon uploads don't wait for the large pkg upload to finish. stream_file makes its own copy of
+        # the headers to add Content-Length, Content-Type is application/json already
+        uploads = {}
+        upload_start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            for blob_type, blob_path in (("pkg", pkg_path), ("pkg_info", pkg_info_path), ("icon", icon_path)):
+                if blob_path is None:
+                    continue
+                self.output(f"Uploading {blob_type}...")
+                uploads[blob_type] = executor.submit(
+                    stream_file,
+                    blob_path,
+                    f"{api_base_url}/api/mam/blobs/uploadblob",
+                    headers,
+                    self.session,
+                    params={"filename": os.path.basename(blob_path), "organizationGroupId": ogid},
+                )
+        self.output(f"Uploads finished in {time.monotonic() - upload_start:.1f}s", verbose_level=2)
 
+        pkg_id = self.upload_blob_id(uploads["pkg"], "pkg")
+        pkginfo_id = self.upload_blob_id(uploads["pkg_info"], "pkginfo")
         icon_id = ""
-        if icon_path is not None:
-            self.output("Uploading icon...")
-            # upload icon file (application/json)
-            headers["Content-Type"] = "application/json"
-            posturl = (
-                f"{api_base_url}/api/mam/blobs/uploadblob?filename={os.path.basename(icon_path)}"
-                f"&organizationGroupId={str(ogid)}"
-            )
+        if "icon" in uploads:
             try:
-                res = stream_file(icon_path, posturl, headers)
-                icon_id = res["Value"]
-                self.output(f"Icon ID: {icon_id}")
-            except KeyError:
-                self.output("Something went wrong while uploading the icon.")
+                icon_id = self.upload_blob_id(uploads["icon"], "icon")
+            except ProcessorError as err:
+                self.output(err)
                 self.output("Continuing app object creation...")
-                pass
 
         # Create a dict with the app details to be passed to WS1 to create the App object
         # include applicationIconId only if we have one
@@ -680,14 +1254,16 @@ class WorkSpaceOneImporter(Processor):
         # Make the API call to create the App object
         self.output("Creating App Object in WorkSpaceOne...")
         self.output(f"app_details: {app_details}", verbose_level=3)
-        r = requests.post(
-            f"{api_base_url}/api/mam/groups/{ogid}/macos/apps",
-            headers=headers,
-            json=app_details,
-        )
+        try:
+            r = self.session.post(
+                f"{api_base_url}/api/mam/groups/{ogid}/macos/apps",
+                headers=headers,
+                json=app_details,
+            )
+        except requests.exceptions.RequestException as err:
+            raise ProcessorError(f"WorkSpaceOneImporter: Unable to create the App Object, error: {err}")
         if not r.status_code == 201:
-            result = r.json()
-            self.output(f"App create result: {result}", verbose_level=3)
+            self.output(f"App create result: {response_error(r)}", verbose_level=3)
             raise ProcessorError("WorkSpaceOneImporter: Unable to create the App Object.")
 
         # Now get the new App ID from the server
@@ -719,11 +1295,45 @@ class WorkSpaceOneImporter(Processor):
             app_assignment = self.ws1_app_assignment_conf(api_base_url, assignment_pushmode, assignment_group, headers)
             self.ws1_app_assign(api_base_url, assignment_group, app_assignment, headers, ws1_app_id)
         else:
-            self.ws1_app_assignments(api_base_url, app_assignments, headers, ws1_app_id)
+            self.ws1_app_assignments(api_base_url, app_assignments, headers, headers_v2, ws1_app_id)
 
         return "Application was successfully uploaded to WorkSpaceOne."
 
-    def ws1_app_assignments(self, api_base_url, app_assignments, headers, ws1_app_id):
+    def upload_blob_id(self, upload, blob_label):
+        """wait for an upload submitted to stream_file and return the blob ID the server assigned to it"""
+        try:
+            blob_id = upload.result()["Value"]
+        except (KeyError, TypeError, OSError, requests.exceptions.RequestException) as err:
+            raise ProcessorError(f"WorkSpaceOneImporter: Something went wrong while uploading the {blob_label}: {err}")
+        self.output(f"{blob_label.capitalize()} ID: {blob_id}")
+        return blob_id
+
+    def ws1_app_wait_deleted(self, api_base_url, ws1_app_id, headers, r, deadline=10.0):
+        """
+        poll until a deleted app is gone from the server, with exponential backoff starting at 0.2 seconds,
+        or the wait the server asks for in a Retry-After header. Raises ProcessorError if the app is still
+        present after deadline seconds.
+        """
+        give_up = time.monotonic() + deadline
+        delay = 0.2
+        while True:
+            try:
+                wait = float(r.headers.get("Retry-After", delay))
+            except ValueError:  # Retry-After can also be an HTTP date, use our own backoff then
+                wait = delay
+            if time.monotonic() + wait > give_up:
+                raise ProcessorError("ws1_force_import - pre-existing app still present after delete, aborting.")
+            time.sleep(wait)
+            try:
+                r = self.session.get(f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}", headers=headers)
+            except requests.exceptions.RequestException as err:
+                raise ProcessorError(f"ws1_force_import - delete of pre-existing app failed, error: {err} aborting.")
+            if r.status_code in (401, 404):
+                return
+            self.output(f"App not deleted yet, status: {r.status_code} - retrying", verbose_level=2)
+            delay = min(delay * 2, 1.6)
+
+    def ws1_app_assignments(self, api_base_url, app_assignments, headers, headers_v2, ws1_app_id, ws1_app=None):
         """
         prep app assignment rules and make API V2 assignments PUT call
         MAM (Mobile Application Management) REST API V2  - PUT /apps/{applicationUuid}/assignment-rules
@@ -734,41 +1344,43 @@ class WorkSpaceOneImporter(Processor):
         with effective_date in the future be deployed or be offered in the Hub or user portal before effective_date.
         For that reason, we need to postpone setting such assignment rules until effective_date, and skip those set
         for a future date until next autopkg session.
+
+        ws1_app can be passed as the app found with the apps search API call, to save a call to get the app UUID.
         """
-        # call Get for internal app to get app UUID
-        try:
-            r = requests.get(f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}", headers=headers)
-            result = r.json()
-        except requests.exceptions.RequestException as err:
-            raise ProcessorError(f"API call to get internal app details failed, error: {err}")
-        if not r.status_code == 200:
-            raise ProcessorError(
-                f"WorkSpaceOneImporter: Unable to get internal app details - message: {result['message']}."
-            )
-        ws1_app_uuid = result["uuid"]
-        app_name = result["ApplicationName"]
-        app_version = result["ActualFileVersion"]
+        if ws1_app is not None:
+            ws1_app_uuid = ws1_app["Uuid"]
+            app_name = ws1_app["ApplicationName"]
+            app_version = ws1_app["ActualFileVersion"]
+        else:
+            # call Get for internal app to get app UUID
+            try:
+                r = self.session.get(f"{api_base_url}/api/mam/apps/internal/{ws1_app_id}", headers=headers)
+            except requests.exceptions.RequestException as err:
+                raise ProcessorError(f"API call to get internal app details failed, error: {err}")
+            if not r.status_code == 200:
+                raise ProcessorError(
+                    f"WorkSpaceOneImporter: Unable to get internal app details - message: {response_error(r)}."
+                )
+            result = response_json(r)
+            ws1_app_uuid = result["uuid"]
+            app_name = result["ApplicationName"]
+            app_version = result["ActualFileVersion"]
         self.output(f"ws1_app_uuid: [{ws1_app_uuid}]", verbose_level=2)
         if not app_assignments == "none":
-            # prepare API V2 headers
-            headers_v2 = dict(headers)
-            headers_v2["Accept"] = f"{headers['Accept']};version=2"
-            self.output(f"API v.2 call headers: {headers_v2}", verbose_level=4)
-
             # get any existing assignment rules and see if they need updating
             try:
-                r = requests.get(
+                r = self.session.get(
                     f"{api_base_url}/api/mam/apps/{ws1_app_uuid}/assignment-rules",
                     headers=headers_v2,
                 )
-                result = r.json()
             except requests.exceptions.RequestException as err:
                 raise ProcessorError(f"API call to get existing app assignment rules failed, error: {err}")
             if not r.status_code == 200:
                 raise ProcessorError(
                     f"WorkSpaceOneImporter: Unable to get existing app assignment rules from WS1 "
-                    f"- message: {result['message']}."
+                    f"- message: {response_error(r)}."
                 )
+            result = response_json(r)
             if not result["assignments"] and not self.env.get("ws1_imported_new"):
                 self.output(
                     "No existing Assignment Rules found, operator must have removed those - skipping.",
@@ -911,31 +1523,24 @@ class WorkSpaceOneImporter(Processor):
                 return
             else:
                 self.output(f"App assignments data to send: {app_assignments}", verbose_level=3)
+                assignment_rules = {"assignments": app_assignments}
+                self.output(f"App assignments rules to send: {assignment_rules}", verbose_level=2)
                 try:
-                    assignment_rules = {"assignments": app_assignments}
-                    payload = json.dumps(assignment_rules)
-                    self.output(
-                        f"App assignments data to send as json: {payload}",
-                        verbose_level=2,
-                    )
-                except ValueError as err:
-                    raise ProcessorError(f"Failed parsing app assignments as json, error: {err}")
-
-                try:
-                    # Make the WS1 APIv2 call to assign the App
-                    r = requests.put(
+                    # Make the WS1 APIv2 call to assign the App, requests serializes the rules as the json body
+                    r = self.session.put(
                         f"{api_base_url}/api/mam/apps/{ws1_app_uuid}/assignment-rules",
                         headers=headers_v2,
-                        data=payload,
+                        json=assignment_rules,
                     )
                 except requests.exceptions.RequestException as err:
                     raise ProcessorError(
                         f"Failed setting assignment-rules for app [{app_name}] version [{app_version}], error: {err}"
                     )
                 if not r.status_code == 202:
-                    result = r.json()
+                    # the Smart Group IDs used in the rules might be stale
+                    self.lookup_cache_invalidate()
                     self.output(
-                        f"Setting App assignment rules failed: {result['errorCode']} - {result['message']}",
+                        f"Setting App assignment rules failed: {response_error(r)}",
                         verbose_level=2,
                     )
                     raise ProcessorError(f"Unable to set assignment rules for [{app_name}] version [{app_version}]")
@@ -996,34 +1601,30 @@ class WorkSpaceOneImporter(Processor):
         MAM (Mobile Application Management) REST API V1  - POST /apps/internal/{applicationId}/assignments
         https://as135.awmdm.com/api/help/#!/InternalAppsV1/InternalAppsV1_AddAssignmentsWithFlexibleDeploymentParametersAsync
         """  # noqa: E501
+        self.output(f"App assignments data to send: {app_assignment}", verbose_level=2)
         try:
-            payload = json.dumps(app_assignment)
-            self.output(f"App assignments data to send: {app_assignment}", verbose_level=2)
-        except ValueError:
-            raise ProcessorError("failed to parse App assignment as json")
-
-        try:
-            # Make the WS1 API call to assign the App
-            r = requests.post(
+            # Make the WS1 API call to assign the App, requests serializes the assignment as the json body
+            r = self.session.post(
                 f"{base_url}/api/mam/apps/internal/{ws1_app_id}/assignments",
                 headers=headers,
-                data=payload,
+                json=app_assignment,
             )
         except requests.exceptions.RequestException:
             raise ProcessorError(
                 f"Something went wrong assigning the app [{self.env['NAME']}] to group [{smart_group}]"
             )
         if not r.status_code == 201:
-            result = r.json()
+            # the Smart Group ID used in the assignment might be stale
+            self.lookup_cache_invalidate()
             self.output(
-                f"App assignments failed: {result['errorCode']} - {result['message']}",
+                f"App assignments failed: {response_error(r)}",
                 verbose_level=2,
             )
             raise ProcessorError(f"Unable to assign the app [{self.env['NAME']}] to the group [{smart_group}]")
         self.env["ws1_app_assignments_changed"] = True
         self.output(f"Successfully assigned the app [{self.env['NAME']}] to the group [{smart_group}]")
 
-    def ws1_app_versions_prune(self, api_base_url, headers, app_name, search_results):
+    def ws1_app_versions_prune(self, api_base_url, headers, headers_v2, app_name, search_results):
         """
         get ws1_app_versions_to_keep_default, defaults to 5
         """
@@ -1070,30 +1671,25 @@ class WorkSpaceOneImporter(Processor):
 
         num_versions_found = 0
 
-        # prepare API V2 headers
-        headers_v2 = dict(headers)
-        headers_v2["Accept"] = f"{headers['Accept']};version=2"
-        self.output(f"API v.2 call headers: {headers_v2}", verbose_level=4)
-
         self.output(f"Looking for old versions of {app_name} on WorkspaceONE")
         app_list = []
 
         for app in search_results["Application"]:
-            if app["Platform"] == 10 and app["ApplicationName"] in app_name:
+            if app["Platform"] == 10 and app["ApplicationName"] == app_name:
                 # get assignment rules to find first deployment date
                 try:
-                    r = requests.get(
+                    r = self.session.get(
                         f"{api_base_url}/api/mam/apps/{app['Uuid']}/assignment-rules",
                         headers=headers_v2,
                     )
-                    result = r.json()
                 except requests.exceptions.RequestException:
                     raise ProcessorError("API call to get existing app assignment rules failed")
                 if not r.status_code == 200:
                     raise ProcessorError(
                         f"WorkSpaceOneImporter: Unable to get existing app assignment rules from WS1 "
-                        f"- message: {result['message']}."
+                        f"- message: {response_error(r)}."
                     )
+                result = response_json(r)
                 try:
                     """ugly hack to split just the date at the T from the returned ISO-8601 as we don't care about the
                     time may have a float as seconds or an int
@@ -1156,7 +1752,7 @@ class WorkSpaceOneImporter(Processor):
                 if row["status"] == "TO BE PRUNED":
                     self.output(f"Deleting old version {row['version']}...", verbose_level=3)
                     try:
-                        r = requests.delete(
+                        r = self.session.delete(
                             f"{api_base_url}/api/mam/apps/internal/{row['App_ID']}",
                             headers=headers,
                         )
@@ -1166,9 +1762,7 @@ class WorkSpaceOneImporter(Processor):
                         )
                     if not r.status_code == 202 and not r.status_code == 204:
                         self.output(f"App delete status code: {r.status_code}", verbose_level=4)
-                        self.output(f"App delete response: {r.text}", verbose_level=4)
-                        result = r.json()
-                        self.output(f"App delete result: {result}", verbose_level=3)
+                        self.output(f"App delete result: {response_error(r)}", verbose_level=3)
                         raise ProcessorError("ws1_app_versions_prune - delete of old app version failed, aborting.")
                     else:
                         self.output(
@@ -1191,6 +1785,122 @@ class WorkSpaceOneImporter(Processor):
                     },
                 }
 
+    def read_run_results(self, run_results_plist):
+        """
+        read the AutoPkg run results plist, re-using the result parsed for a previous recipe in this run if the file
+        was not modified since, going by its modification time and size
+        """
+        try:
+            stat = os.stat(run_results_plist)
+            key = (run_results_plist, stat.st_mtime_ns, stat.st_size)
+            if self._run_results_cache and self._run_results_cache[:3] == key:
+                return self._run_results_cache[3]
+            with open(run_results_plist, "rb") as f:
+                run_results = plistlib.load(f)
+        except IOError:
+            return []
+        except (plistlib.InvalidFileException, ValueError, ExpatError):
+            # AutoPkg may be writing the file right now, don't cache, the next call reads it again
+            return []
+        WorkSpaceOneImporter._run_results_cache = (*key, run_results)
+        return run_results
+
+    def pkginfo_has_hash(self, pkginfo_path, itemhash):
+        """True if the pkginfo file at pkginfo_path can be read and records installer_item_hash itemhash"""
+        if not pkginfo_path:
+            return False
+        try:
+            pkg_info = load_pkginfo(pkginfo_path, os.stat(pkginfo_path).st_mtime_ns)
+        except Exception as err:
+            self.output(f"Could not read pkg_info file [{pkginfo_path}] error: {err}", verbose_level=2)
+            return False
+        return isinstance(pkg_info, dict) and pkg_info.get("installer_item_hash") == itemhash
+
+    def pkginfo_index_path(self):
+        """path of the file in the AutoPkg cache dir used to keep the installer_item_hash of scanned pkginfo files"""
+        return self.cache_file_path("ws1_pkginfo_index.json")
+
+    def find_pkginfo(self, installer_info_dir, itemhash):
+        """
+        find the pkginfo file in installer_info_dir with installer_item_hash itemhash, raises if there is none.
+        The installer_item_hash of each pkginfo file is kept in an index file with its modification time, so only
+        pkginfo files that were added or changed since an earlier scan need to be parsed.
+        """
+        pkginfo_index_file = self.pkginfo_index_path()
+        try:
+            with open(pkginfo_index_file, "r") as fp:
+                pkginfo_index = json.load(fp)
+        except FileNotFoundError:
+            pkginfo_index = {}
+        except (OSError, ValueError) as err:
+            self.output(f"Ignoring unreadable pkginfo index file [{pkginfo_index_file}]: {err}", verbose_level=2)
+            pkginfo_index = {}
+        dir_index = pkginfo_index.get(installer_info_dir, {})
+        # a pkginfo file indexed with the hash that is unchanged since is the match, no need to scan the dir
+        for pi, (mtime, iih) in dir_index.items():
+            if iih == itemhash:
+                try:
+                    if os.stat(pi).st_mtime_ns == mtime:
+                        self.output(f"Found matching installer info file in pkginfo index [{pi}]", verbose_level=2)
+                        return pi
+                except OSError:
+                    pass
+        scanned = {}
+
+        # walk the dir to check each pkginfo file for matching hash
+        self.output(
+            f"scanning [{installer_info_dir}] to find matching pkginfo file with installer_item_hash "
+            f"value: [{itemhash}]",
+            verbose_level=2,
+        )
+        found_match = False
+        pi = ""
+        for entry in scan_files(installer_info_dir):
+            if entry.name == ".DS_Store":
+                continue
+            pi = entry.path
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except OSError:
+                raise ProcessorError(f"Could not read pkg_info file [{pi}]")
+            indexed = dir_index.get(pi)
+            if indexed and indexed[0] == mtime:
+                iih = indexed[1]
+            else:
+                self.output(
+                    f"checking [{entry.name}] to find matching installer_item_hash",
+                    verbose_level=2,
+                )
+                try:
+                    iih = read_installer_item_hash(pi, mtime)
+                except IOError:
+                    raise ProcessorError(f"Could not read pkg_info file [{pi}]")
+                except Exception as err:
+                    raise ProcessorError(f"Could not parse pkg_info file [{pi}] error: {err}")
+            scanned[pi] = [mtime, iih]
+            if iih == itemhash:
+                found_match = True
+                self.output(
+                    f"installer_item_hash match found: [{iih}]",
+                    verbose_level=4,
+                )
+                self.output(
+                    f"Found matching installer info file in munki repo [{pi}]",
+                    verbose_level=2,
+                )
+                break
+
+        # after a full scan the index for the dir is complete, files that were removed are dropped from it
+        pkginfo_index[installer_info_dir] = {**dir_index, **scanned} if found_match else scanned
+        try:
+            write_json_atomic(pkginfo_index_file, pkginfo_index)
+        except OSError as err:
+            self.output(f"Could not write pkginfo index file [{pkginfo_index_file}]: {err}", verbose_level=2)
+
+        if not found_match:
+            raise ProcessorError(f"Failed to find matching pkginfo in [{installer_info_dir}]")
+        return pi
+
     def main(self):
         """Rebuild Munki catalogs in repo_path"""
 
@@ -1200,22 +1910,10 @@ class WorkSpaceOneImporter(Processor):
         self.env["ws1_imported_new"] = False
         self.env["ws1_app_assignments_changed"] = False
 
-        cache_dir = get_pref("CACHE_DIR") or os.path.expanduser("~/Library/AutoPkg/Cache")
-        current_run_results_plist = os.path.join(cache_dir, "autopkg_results.plist")
-        try:
-            with open(current_run_results_plist, "rb") as f:
-                run_results = plistlib.load(f)
-        except IOError:
-            run_results = []
-
         munkiimported_new = False
 
         # get ws1_import_new_only, defaults to True
-        import_new_only = self.env.get("ws1_import_new_only", "True").lower() in (
-            "true",
-            "1",
-            "t",
-        )
+        import_new_only = is_truthy(self.env.get("ws1_import_new_only", "True"))
 
         # key munki_importer_summary_result might not exist, nor data or pkginfo_path, try-catch is simplest
         try:
@@ -1227,7 +1925,9 @@ class WorkSpaceOneImporter(Processor):
             munkiimported_new = True
 
         if not munkiimported_new and import_new_only:
-            self.output(run_results)
+            # run results are only used here, don't read them when there is an import to do
+            current_run_results_plist = self.cache_file_path("autopkg_results.plist")
+            self.output(self.read_run_results(current_run_results_plist))
             self.output("No updates so nothing to import to WorkSpaceOne")
             self.env["ws1_resultcode"] = 0
             self.env["ws1_stderr"] = ""
@@ -1245,13 +1945,14 @@ class WorkSpaceOneImporter(Processor):
                 verbose_level=2,
             )
             # hash code copied from Munki's pkginfolib.py and function from hash lib munkihash.py
+            # both hashes use SHA-256, the repo item hash is also used below to find the pkginfo by installer_item_hash
             # get size of installer item
             citemsize = 0
             citemhash = "N/A"
             if os.path.isfile(ci):
                 citemsize = int(os.path.getsize(ci))
                 try:
-                    citemhash = getsha256hash(ci)
+                    citemhash = self.cached_sha256(ci)
                 except OSError as err:
                     raise ProcessorError(err)
 
@@ -1263,76 +1964,56 @@ class WorkSpaceOneImporter(Processor):
             self.output(f"MUNKI_REPO: {munki_repo}", verbose_level=2)
             if os.path.isfile(pkg):
                 itemsize = int(os.path.getsize(pkg))
-                installer_item_path = pkg[len(munki_repo) + 1 :]  # get path relative from repo
-                if not itemsize == citemsize:
+                installer_item_path = os.path.relpath(pkg, munki_repo)  # get path relative from repo
+                pi = self.env.get("pkginfo_repo_path")
+                if itemsize == citemsize and self.pkginfo_has_hash(pi, citemhash):
+                    # MunkiImporter matched the cached installer to this pkginfo, which records the cached installer
+                    # hash, and the repo item has the same size, no need to hash it again and search for its pkginfo
                     self.output(
-                        "size of item in local munki repo differs from cached, might be a Git LFS shortcut, "
-                        "pulling remote",
+                        f"pkginfo [{pi}] set by MunkiImporter matches cached installer, skipping repo item hash",
                         verbose_level=2,
                     )
-                    self.git_lfs_pull(munki_repo, installer_item_path)
-                try:
-                    itemhash = getsha256hash(pkg)
-                    if not itemhash == citemhash:
-                        if os.path.splitext(pkg)[1][1:].lower() == "dmg":
-                            self.output(
-                                "Installer dmg item in Munki repo differs from cached installer, this is expected if "
-                                "your recipe has a DmgCreator step; checking dmg checksum.",
-                                verbose_level=2,
-                            )
-                            result = subprocess.run(["hdiutil", "verify", "-quiet", pkg])
-                            if not result.returncode == 0:
-                                raise ProcessorError(f"Installer dmg verification failed for [{pkg}]")
-                        else:
-                            raise ProcessorError(
-                                "Installer item in Munki repo differs from cached installer, please check."
-                            )
-                except OSError as err:
-                    raise ProcessorError(err)
-
-                # look in same dir from pkgsinfo/ for matching pkginfo file
-                installer_item_dir = os.path.dirname(pkg)
-                installer_info_dir = re.sub(r"/pkgs", "/pkgsinfo", installer_item_dir)
-                # walk the dir to check each pkginfo file for matching hash
-                self.output(
-                    f"scanning [{installer_info_dir}] to find matching pkginfo file with installer_item_hash "
-                    f"value: [{itemhash}]",
-                    verbose_level=2,
-                )
-                found_match = False
-                pi = ""
-                for path, _subdirs, files in os.walk(installer_info_dir):
-                    for name in files:
-                        if name == ".DS_Store":
-                            continue
-                        pi = os.path.join(path, name)
-                        self.output(
-                            f"checking [{name}] to find matching installer_item_hash",
-                            verbose_level=2,
-                        )
-                        try:
-                            with open(pi, "rb") as fp:
-                                pkg_info = plistlib.load(fp)
-                        except IOError:
-                            raise ProcessorError(f"Could not read pkg_info file [{pi}]")
-                        except Exception as err:
-                            raise ProcessorError(f"Could not parse pkg_info file [{pi}] error: {err}")
-                        if "installer_item_hash" in pkg_info and pkg_info["installer_item_hash"] == itemhash:
-                            found_match = True
-                            iih = pkg_info["installer_item_hash"]
-                            self.output(
-                                f"installer_item_hash match found: [{iih}]",
-                                verbose_level=4,
-                            )
-                            break
-                    if found_match:
+                else:
+                    if not itemsize == citemsize:
                         self.output(
-                            f"Found matching installer info file in munki repo [{pi}]",
+                            "size of item in local munki repo differs from cached, might be a Git LFS shortcut, "
+                            "pulling remote",
                             verbose_level=2,
                         )
-                        break
-                if not found_match:
-                    raise ProcessorError(f"Failed to find matching pkginfo in [{installer_info_dir}]")
+                        self.git_lfs_pull(munki_repo, installer_item_path)
+                    try:
+                        itemhash = self.cached_sha256(pkg)
+                        if not itemhash == citemhash:
+                            if os.path.splitext(pkg)[1][1:].lower() == "dmg":
+                                self.output(
+                                    "Installer dmg item in Munki repo differs from cached installer, this is expected "
+                                    "if your recipe has a DmgCreator step; checking dmg checksum.",
+                                    verbose_level=2,
+                                )
+                                if self.pkginfo_has_hash(pi, itemhash):
+                                    # Munki hashed this dmg when it was imported, it is unchanged since, no need for
+                                    # hdiutil to read all of it again
+                                    self.output(
+                                        f"dmg matches installer_item_hash in pkginfo [{pi}], skipping hdiutil verify",
+                                        verbose_level=2,
+                                    )
+                                else:
+                                    result = subprocess.run(["hdiutil", "verify", "-quiet", pkg])
+                                    if not result.returncode == 0:
+                                        raise ProcessorError(f"Installer dmg verification failed for [{pkg}]")
+                            else:
+                                raise ProcessorError(
+                                    "Installer item in Munki repo differs from cached installer, please check."
+                                )
+                    except OSError as err:
+                        raise ProcessorError(err)
+
+                    # look in same dir from pkgsinfo/ for matching pkginfo file, only the pkgs/ dir at the top of the
+                    # repo is swapped, as the repo path or subdirs of pkgs/ might contain "/pkgs" as well
+                    installer_item_subdir = os.path.relpath(os.path.dirname(pkg), os.path.join(munki_repo, "pkgs"))
+                    installer_info_dir = os.path.normpath(os.path.join(munki_repo, "pkgsinfo", installer_item_subdir))
+                    if not self.pkginfo_has_hash(pi, itemhash):
+                        pi = self.find_pkginfo(installer_info_dir, itemhash)
             else:
                 #
                 raise ProcessorError(f"Failed to read installer [{pkg}]")
@@ -1341,33 +2022,9 @@ class WorkSpaceOneImporter(Processor):
             pi = self.env["pkginfo_repo_path"]
             pkg = self.env["pkg_repo_path"]
 
-        # Get icon file settings. Read pkginfo plist file to find if specific icon_path key is present, if so
-        # use that. If not, check for common icon file. Proceed to WS1 with what we have regardless.
-        try:
-            with open(pi, "rb") as fp:
-                pkg_info = plistlib.load(fp)
-        except IOError:
-            raise ProcessorError(f"Could not read pkg_info file [{pi}] to check icon_name ")
-        except Exception:
-            raise ProcessorError(f"Failed to parse pkg_info file [{pi}] somehow.")
-        if "icon_name" not in pkg_info:
-            # if key isn't present, look for common icon file with same 'first' name as installer item
-            icon_path = f"{self.env['MUNKI_REPO']}/icons/{self.env['NAME']}.png"
-            self.output(f"Looking for icon file [{icon_path}]", verbose_level=1)
-        else:
-            # when icon was specified for this installer version
-            icon_path = f"{self.env['MUNKI_REPO']}/icons/{pkg_info['icon_name']}"
-            self.output(f"Icon file for this installer version was specified as [{icon_path}]")
-        # if we can't read or find any icon, proceed with upload regardless
-        if not os.path.exists(icon_path):
-            self.output(f"Could not read icon file [{icon_path}] - skipping.")
-            icon_path = None
-        elif icon_path is None:
-            self.output("Could not find any icon file - skipping.")
-        self.output(self.ws1_import(pkg, pi, icon_path))
+        self.output(self.ws1_import(pkg, pi))
 
 
 if __name__ == "__main__":
-    # PROCESSOR = MakeCatalogsProcessor()
     PROCESSOR = WorkSpaceOneImporter()
     PROCESSOR.execute_shell()